@@ -2,6 +2,8 @@
 # The UI will allow the user to input their target allocation and their current holdings
 # The UI will also allow the user to input select the initial holdings of the portfolio
 
+import copy
+
 import streamlit as st
 import pandas as pd
 
@@ -20,6 +22,7 @@ ALL_STOCKS = [
     Stock("MSFT", 450.00), 
     Stock("NVDA", 130.00)
 ]
+ALL_STOCK_MAP = {stock.symbol: stock for stock in ALL_STOCKS}
 DEFAULT_TARGET_ALLOCATION = {
     "AAPL": 0.30, "META": 0.20, "GOOG": 0.20, "MSFT": 0.20, "NVDA": 0.10
 }
@@ -28,18 +31,68 @@ DEFAULT_INITIAL_HOLDINGS = {
     "AAPL": 10.0, "META": 5.0,
 }
 
+# The sidebar labels never change, so we build them once instead of on every rerun
+STOCK_LABELS = {stock.symbol: f"Shares of {stock.symbol}" for stock in ALL_STOCKS}
+
+# Streamlit reruns the whole script on every widget interaction, so the totals get recomputed constantly
+# st.cache_data needs a hashable key, so we pass portfolio.snapshot() instead of the Portfolio object
+@st.cache_data
+def compute_total_value(snapshot: tuple[tuple[str, float, float], ...]) -> float:
+    return sum(shares * price for _, shares, price in snapshot)
+
+# The leading underscore tells streamlit not to hash the portfolio, the snapshot (and targets) are the cache key
+@st.cache_data
+def compute_rebalance_plan(snapshot: tuple[tuple[str, float, float], ...], targets: tuple[tuple[str, float], ...], _portfolio: Portfolio) -> dict[str, pd.DataFrame]:
+    return _portfolio.create_rebalance_plan()
+
+@st.cache_data
+def holdings_df(snapshot: tuple[tuple[str, float, float], ...], _portfolio: Portfolio) -> pd.DataFrame:
+    return _portfolio.get_holdings_dataframe()
+
+# Holdings and targets are shown in one table, so streamlit only has to serialize one dataframe per rerun
+@st.cache_data
+def allocation_table(snapshot: tuple[tuple[str, float, float], ...], targets: tuple[tuple[str, float], ...], _portfolio: Portfolio) -> pd.DataFrame:
+    target_df = pd.DataFrame({
+        "Symbol": [symbol for symbol, _ in targets],
+        "Target": [f"{target:.2%}" for _, target in targets],
+    })
+    table = holdings_df(snapshot, _portfolio).set_index('Symbol').join(target_df.set_index('Symbol'), how='outer')
+    # Stocks we dont own (or dont target) have no value in the other columns
+    return table.fillna("")
+
 # 2. Create Portfolio
+# Building a Portfolio re-creates the stock arrays and re-validates the targets, so we only do it once per
+# unique (stocks, targets) config with st.cache_resource.
+# The cached portfolio is shared by every session (and every script thread), so it is only used as a template and never changed.
+# Each session gets its own copy.copy of it, which shares the read-only market/target parts and has its own shares.
+ALL_STOCKS_KEY = tuple((stock.symbol, stock.price) for stock in ALL_STOCKS)
+
+def target_key(target_allocation: dict[str, float]) -> tuple[tuple[str, float], ...]:
+    return tuple(sorted(target_allocation.items()))
+
+# Every distinct slider combination is a new entry, so we only keep the most recent configs around
+@st.cache_resource(max_entries=32)
+def make_portfolio(stocks_key: tuple[tuple[str, float], ...], targets_key: tuple[tuple[str, float], ...]) -> Portfolio:
+    # stocks_key is only there so a price change gives a new cache entry, the stocks come from ALL_STOCK_MAP
+    return Portfolio(ALL_STOCK_MAP, dict(targets_key))
+
+def new_portfolio(target_allocation: dict[str, float], holdings: dict[str, float]) -> Portfolio:
+    portfolio = copy.copy(make_portfolio(ALL_STOCKS_KEY, target_key(target_allocation)))
+    portfolio.holdings = holdings
+    return portfolio
+
 # We will use the session state to prevent the portfolio from being created multiple times and withstand refreshes
 if 'portfolio' not in st.session_state: 
     st.session_state.target_allocation = DEFAULT_TARGET_ALLOCATION.copy()
     
-    st.session_state.portfolio = Portfolio(
-        ALL_STOCKS, 
-        st.session_state.target_allocation,
-        initial_holdings=DEFAULT_INITIAL_HOLDINGS
-    )
+    st.session_state.portfolio = new_portfolio(st.session_state.target_allocation, DEFAULT_INITIAL_HOLDINGS)
     st.session_state.rebalance_plan = None
 
+# Every st.session_state access goes through streamlit's state proxy, so we keep local references for this run
+# The handlers below rebind them together with the session state before calling st.rerun()
+portfolio = st.session_state.portfolio
+target_allocation = st.session_state.target_allocation
+
 
 # 3. Sidebar for User Inputs
 with st.sidebar:
@@ -47,32 +100,34 @@ with st.sidebar:
     st.write("Enter the number of shares you own for each stock.")
 
     with st.form("holdings_form"):
-        share_inputs = {stock.symbol: st.number_input(
-            f"Shares of {stock.symbol}", min_value=0.0,
-            value=st.session_state.portfolio.holdings.get(stock.symbol, 0.0),
-            step=1.0, format="%.4f"
-        ) for stock in ALL_STOCKS}
+        # portfolio.holdings builds a new dict on every access, so we read it once
+        current_holdings = portfolio.holdings
+        share_inputs = dict.fromkeys(STOCK_LABELS, 0.0)
+        for symbol, label in STOCK_LABELS.items():
+            share_inputs[symbol] = st.number_input(
+                label, min_value=0.0,
+                value=current_holdings.get(symbol, 0.0),
+                step=1.0, format="%.4f"
+            )
         
         if st.form_submit_button("Update Portfolio Holdings"):
-            st.session_state.portfolio = Portfolio(ALL_STOCKS, st.session_state.target_allocation)
-            for symbol, shares in share_inputs.items():
-                if shares > 0:
-                    st.session_state.portfolio.add_position(symbol, shares)
+            # The portfolio belongs to this session, so we can replace its holdings in place
+            portfolio.holdings = share_inputs
             st.session_state.rebalance_plan = None
             st.success("Portfolio updated!")
             st.rerun()
 
     if st.button("Reset All"):
-        st.session_state.target_allocation = DEFAULT_TARGET_ALLOCATION.copy()
-        st.session_state.portfolio = Portfolio(ALL_STOCKS, st.session_state.target_allocation)
+        target_allocation = st.session_state.target_allocation = DEFAULT_TARGET_ALLOCATION.copy()
+        portfolio = st.session_state.portfolio = new_portfolio(target_allocation, {})
         st.session_state.rebalance_plan = None
         st.rerun()
 
 
 # 4. Main Content
 
-current_holdings_df = st.session_state.portfolio.get_holdings_dataframe()
-total_value = st.session_state.portfolio.get_total_value()
+snapshot = portfolio.snapshot()
+total_value = compute_total_value(snapshot)
 
 # Section 1: Portfolio overview
 
@@ -81,7 +136,12 @@ if total_value == 0:
     st.info("Your portfolio is empty. Add some holdings in the sidebar to get started.")
 else:
     st.metric(label="Total Portfolio Value", value=f"${total_value:,.2f}")
-    st.dataframe(current_holdings_df.set_index('Symbol'), use_container_width=True)
+
+# We show the holdings next to the target allocation in a clean table
+st.dataframe(
+    allocation_table(snapshot, target_key(target_allocation), portfolio),
+    use_container_width=True
+)
 
 st.divider()
 
@@ -92,37 +152,26 @@ with st.expander("Edit Target Allocation", expanded=False):
         st.write("Use the sliders to set your desired allocation. The total must be 100%.")
         new_targets_percent = {}
         # Streamlit has prebuilt sliders
-        for symbol, target_pct in st.session_state.target_allocation.items():
+        for symbol, target_pct in target_allocation.items():
             new_targets_percent[symbol] = st.slider(
                 f"Allocation for {symbol}", 0, 100, int(target_pct * 100)
             )
         
         total_allocation = sum(new_targets_percent.values())
-        print("TOTAL total_allocation", total_allocation)
         st.write(f"**Total Allocation: {total_allocation}%**")
 
         if st.form_submit_button("Update Targets"):
             if not total_allocation == 100:
                 st.error("Error: Total allocation must be exactly 100%. Please adjust the sliders.")
             else:
-                # when a new target allocation is set, its best to create a "new" portfolio
-                # this will ensure that the portfolio is updated with the new target allocation
-                # even though is "counterintuitive", its better to do it this way when dealing with app state
-                st.session_state.target_allocation = {s: p / 100.0 for s, p in new_targets_percent.items()}
-                st.session_state.portfolio = Portfolio(
-                    ALL_STOCKS,
-                    st.session_state.target_allocation,
-                    initial_holdings=st.session_state.portfolio.holdings
-                )
+                # when a new target allocation is set, the session gets a new portfolio for that config
+                # (a copy of the cached one) and the current holdings are carried over
+                target_allocation = st.session_state.target_allocation = {s: p / 100.0 for s, p in new_targets_percent.items()}
+                portfolio = st.session_state.portfolio = new_portfolio(target_allocation, portfolio.holdings)
                 st.session_state.rebalance_plan = None
                 st.success("Target allocation updated!")
                 st.rerun()
 
-# We show updated target allocation in a clean table
-target_df = pd.DataFrame(list(st.session_state.target_allocation.items()), columns=['Symbol', 'Target'])
-target_df['Target'] = target_df['Target'].apply(lambda x: f"{x:.2%}")
-st.dataframe(target_df.set_index('Symbol'), use_container_width=True)
-
 st.divider()
 
 # Section 3: Rebalancing Actions
@@ -135,11 +184,11 @@ if total_value > 0:
     col1, col2 = st.columns(2)
     with col1:
         if st.button("Generate Rebalance Plan", type="primary", use_container_width=True):
-            st.session_state.rebalance_plan = st.session_state.portfolio.create_rebalance_plan()
+            st.session_state.rebalance_plan = compute_rebalance_plan(snapshot, target_key(target_allocation), portfolio)
 
     if st.session_state.rebalance_plan:
         plan = st.session_state.rebalance_plan
-        if not plan["buy"] and not plan["sell"]:
+        if plan["buy"].empty and plan["sell"].empty:
             st.success("Your portfolio is already balanced. No trades needed!")
             st.session_state.rebalance_plan = None # Clear the plan
             st.rerun()
@@ -148,21 +197,19 @@ if total_value > 0:
             col_buy, col_sell = st.columns(2)
             with col_buy:
                 st.write("**Buy Orders**")
-                if plan["buy"]:
-                    buy_df = pd.DataFrame(plan["buy"]).rename(columns={"symbol": "Symbol", "amount_in_dollars": "Amount ($)"})
-                    st.dataframe(buy_df.set_index('Symbol'), use_container_width=True)
+                if not plan["buy"].empty:
+                    st.dataframe(plan["buy"].set_index('Symbol'), use_container_width=True)
                 else:
                     st.write("None")
             with col_sell:
                 st.write("**Sell Orders**")
-                if plan["sell"]:
-                    sell_df = pd.DataFrame(plan["sell"]).rename(columns={"symbol": "Symbol", "amount_in_dollars": "Amount ($)"})
-                    st.dataframe(sell_df.set_index('Symbol'), use_container_width=True)
+                if not plan["sell"].empty:
+                    st.dataframe(plan["sell"].set_index('Symbol'), use_container_width=True)
                 else:
                     st.write("None")
             with col2:
                 if st.button("Execute Rebalance Plan", use_container_width=True):
-                    st.session_state.portfolio.execute_rebalance(plan)
+                    portfolio.execute_rebalance(plan)
                     st.session_state.rebalance_plan = None # Clear the plan
                     st.success("Rebalance complete! Your portfolio is now updated.")
                     st.rerun()
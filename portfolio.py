@@ -1,17 +1,30 @@
+import numpy as np
 import pandas as pd
 import math
+from types import MappingProxyType
+
+# numba is optional and NOT installed by default (see the README)
+# Only if it is installed the rebalance kernel below is compiled, otherwise njit does nothing and it runs as plain numpy
+try:
+    from numba import njit
+except ImportError:
+    def njit(*args, **kwargs):
+        return lambda func: func
 
 # Stock Class needs to hold its symbol and its price
 # Intially, current price will be a given value.
 # It can then be updated to fetch real-time price from an API (yahoo finance).
 
 class Stock:
+    # __slots__ drops the per-instance __dict__, the objects are smaller and attribute access is faster
+    __slots__ = ("symbol", "price")
+
     def __init__(self, symbol: str, current_price: float):
         self.symbol = symbol
-        self._price = current_price
+        self.price = current_price
     
     def current_price(self):
-        return self._price  
+        return self.price
     
 
 # Portfolio Class needs to hold a list of Stock objects and a target allocation
@@ -23,40 +36,122 @@ class Stock:
 
 # Once the rebalance amount is calculated, it needs to update the holdings of the portfolio
 
-# I am adding a list of all tradable stocks to the Portfolio class so I can deal with stocks outside my initial holdings
+# I am adding a map of all tradable stocks ({symbol: Stock}) to the Portfolio class so I can deal with stocks outside my initial holdings
 # (i.e. if I have a target allocation of 50% for a stock that I don't own, I need to buy it, therefore the "portfolio" needs to know about it)
 # It will also allow me to validate that a new stock added to the portfolio is valid
 # its basically giving the portfolio "access to the market"
+# The market usually doesn't change between portfolios, so the caller builds the map once and passes it in
 
 class Portfolio:
-    def __init__(self, all_tradable_stocks: list[Stock], target_allocation: dict[str, float], initial_holdings: dict[str, float] = None):
+    __slots__ = ("_target_allocation", "symbols", "_symbols", "_idx", "targets_arr", "_prices", "_shares", "_total_dirty", "_total_cache")
+
+    def __init__(self, stock_map: dict[str, Stock], target_allocation: dict[str, float], initial_holdings: dict[str, float] = None):
         
         # Bug: Decimal precision issue
-        # I will use math.isclose to compare the sum of the target allocation to 1.0
-        if not math.isclose(sum(target_allocation.values()), 1.0):
-            print(target_allocation.values())
-            print(sum(target_allocation.values()))
-            raise ValueError("Target allocation percentages must sum to 1.0.")
-
-        self.target_allocation = target_allocation
-        self.stock_objects = {stock.symbol: stock for stock in all_tradable_stocks}
-        self.holdings = initial_holdings if initial_holdings is not None else {}
-
-        for symbol in self.target_allocation:
-            if symbol not in self.stock_objects:
+        # A plain sum() accumulates rounding errors (e.g. 0.3 + 0.2 + 0.2 + 0.2 + 0.1), math.fsum is exact
+        # and a small absolute tolerance makes the check stable for any normalized input
+        total_allocation = math.fsum(target_allocation.values())
+        if abs(total_allocation - 1.0) > 1e-9:
+            raise ValueError(f"Target allocation percentages must sum to 1.0 (got {total_allocation}).")
+
+        # The targets are a private copy, only exposed read-only, so they can't get out of sync with targets_arr below
+        # (a plain dict and not a MappingProxyType, so the portfolio can still be pickled)
+        # To change the targets, create a new Portfolio
+        self._target_allocation = dict(target_allocation)
+
+        # The market is stored as parallel arrays (Structure of Arrays) instead of a dict of Stock objects
+        # symbols[i] has price _prices[i] and we hold _shares[i] of it, idx maps a symbol back to its position
+        # This way the totals and the rebalance math are single numpy operations instead of python loops
+        # The arrays are private: every change to the shares must go through a method, so the cached total stays valid
+        self.symbols = tuple(stock_map)
+        # numpy copy of the symbols, so the plan can pick the order symbols with an index array
+        self._symbols = np.array(self.symbols, dtype=object)
+        self._symbols.flags.writeable = False
+        self._idx = {symbol: i for i, symbol in enumerate(self.symbols)}
+        self._prices = np.array([stock.price for stock in stock_map.values()], dtype=np.float64)
+        self._prices.flags.writeable = False
+        self._shares = np.zeros(len(self.symbols), dtype=np.float64)
+
+        # The total value is cached until the holdings change, every method that changes shares sets _total_dirty
+        self._total_dirty = True
+        self._total_cache = None
+
+        for symbol in self._target_allocation:
+            if symbol not in self._idx:
                 raise ValueError(f"Stock '{symbol}' in target allocation is not in tradable stocks list.")
 
+        # The target allocation is also stored as an array aligned with symbols, built once here
+        # Stocks that are not in the target allocation get a 0 percentage
+        self.targets_arr = np.zeros(len(self.symbols), dtype=np.float64)
+        for symbol, target_percent in self._target_allocation.items():
+            self.targets_arr[self._idx[symbol]] = target_percent
+        self.targets_arr.flags.writeable = False
+
+        if initial_holdings is not None:
+            self.holdings = initial_holdings
+
+    # The targets and the symbol -> position map are plain dicts (so the portfolio can still be pickled),
+    # shared as read-only views
+
+    @property
+    def target_allocation(self) -> MappingProxyType:
+        return MappingProxyType(self._target_allocation)
+
+    @property
+    def idx(self) -> MappingProxyType:
+        return MappingProxyType(self._idx)
+
+    # copy.copy(portfolio) gives a portfolio with the same market and targets but its own shares
+    # The market and target parts are read-only, so the copies can share them safely
+    # (the streamlit app uses this to give every session its own portfolio from one cached one)
+
+    def __copy__(self):
+        portfolio = Portfolio.__new__(Portfolio)
+        portfolio._target_allocation = self._target_allocation
+        portfolio.symbols = self.symbols
+        portfolio._symbols = self._symbols
+        portfolio._idx = self._idx
+        portfolio.targets_arr = self.targets_arr
+        portfolio._prices = self._prices
+        portfolio._shares = self._shares.copy()
+        portfolio._total_dirty = True
+        portfolio._total_cache = None
+        return portfolio
+
+    # The holdings are still exposed as a {symbol: shares} dict (only the stocks we actually own)
+    # so the UI doesn't need to know about the arrays. Assigning a dict replaces all the holdings.
+
+    @property
+    def holdings(self) -> dict[str, float]:
+        # Same as in get_holdings_dataframe, a plain list is cheaper to read than numpy scalars
+        shares = self._shares.tolist()
+        return {symbol: held for symbol, held in zip(self.symbols, shares) if held > 0}
+
+    @holdings.setter
+    def holdings(self, holdings: dict[str, float]):
+        self._shares[:] = 0.0
+        self._total_dirty = True
+        for symbol, shares in holdings.items():
+            self.add_position(symbol, shares)
+
     def add_position(self, symbol: str, shares: float):
-        if symbol not in self.stock_objects:
+        if symbol not in self._idx:
             raise ValueError(f"Error: Cannot add position for '{symbol}'. It is not a known tradable stock.")
         if shares > 0:
-            self.holdings[symbol] = self.holdings.get(symbol, 0.0) + shares
+            self._shares[self._idx[symbol]] += shares
+            self._total_dirty = True
+
+    # A hashable (symbol, shares, price) tuple of the whole market, sorted by symbol
+    # The streamlit app uses it as the cache key for everything it derives from the portfolio
+
+    def snapshot(self) -> tuple[tuple[str, float, float], ...]:
+        return tuple(sorted(zip(self.symbols, self._shares.tolist(), self._prices.tolist())))
 
     def get_total_value(self) -> float:
-        total_value = 0.0
-        for symbol, shares in self.holdings.items():
-            total_value += shares * self.stock_objects[symbol].current_price()
-        return total_value
+        if self._total_dirty:
+            self._total_cache = float(self._shares @ self._prices)
+            self._total_dirty = False
+        return self._total_cache
 
     # This function will print the current state of the portfolio
     # Helpful for monitoring and debuging
@@ -68,8 +163,9 @@ class Portfolio:
             return
             
         print(f"Total Portfolio Value: ${total_value:,.2f}")
+        prices = self._prices.tolist()
         for symbol, shares in sorted(self.holdings.items()):
-            value = shares * self.stock_objects[symbol].current_price()
+            value = shares * prices[self._idx[symbol]]
             percentage = (value / total_value) * 100 if total_value > 0 else 0
             if percentage > 0:
                 print(f"  {symbol}: {shares:.4f} shares, Value: ${value:,.2f} ({percentage:.2f}%)")
@@ -81,13 +177,16 @@ class Portfolio:
     def get_holdings_dataframe(self) -> pd.DataFrame:
         total_value = self.get_total_value()
         records = []
+        # Pull the prices into a plain list once, indexing a python list is cheaper than a numpy scalar lookup
+        prices = self._prices.tolist()
         for symbol, shares in sorted(self.holdings.items()):
-            value = shares * self.stock_objects[symbol].current_price()
+            price = prices[self._idx[symbol]]
+            value = shares * price
             percentage = (value / total_value) * 100 if total_value > 0 else 0
             records.append({
                 "Symbol": symbol,
                 "Shares": f"{shares:.4f}",
-                "Current Price": f"${self.stock_objects[symbol].current_price():,.2f}",
+                "Current Price": f"${price:,.2f}",
                 "Market Value": f"${value:,.2f}",
                 "Allocation (%)": f"{percentage:.2f}%"
             })
@@ -104,67 +203,70 @@ class Portfolio:
     # Then calculate the rebalance amount for each stock
 
     # Given that I can either buy or sell (or do nothing), the posible actions are:
-    # If the difference is greater than 0.01, add it to the buy list
-    # If the difference is less than -0.01, add it to the sell list
+    # If the difference is greater than 0.01, add it to the buy orders
+    # If the difference is less than -0.01, add it to the sell orders
     # If the difference is between -0.01 and 0.01, do nothing
 
     # Its better to have a small margin than to be deterministic with the numbers, as stock prices fluctuate real-time 
 
-    def create_rebalance_plan(self) -> dict[str, list]:
-        total_portfolio_value = self.get_total_value()
-        actions = {"buy": [], "sell": []}
+    # The buy and sell orders are returned as DataFrames with a "Symbol" and an "Amount ($)" column
+    # They are built straight from the numpy arrays, so the streamlit app can display them as they are
 
-        # Quick check to see if the portfolio is empty
-        if total_portfolio_value == 0:
-            return actions
-        
+    def create_rebalance_plan(self) -> dict[str, pd.DataFrame]:
         # bug found: If the target allocation dictionary does not have the same stocks as the
         # total market stock, the rebalance plan will not work as expected
         # because it wont be assigned a 0 in my target allocation
+        # this is handled by targets_arr, which already has a 0 for every stock without a target
 
-        # to fix this, I need to add the missing stocks to the target allocation
-        # and assign them a 0 percentage
-        
-        for symbol in self.stock_objects:
-            if symbol not in self.target_allocation:
-                self.target_allocation[symbol] = 0.0
-        
-        for symbol, target_percent in self.target_allocation.items():
-            target_value = total_portfolio_value * target_percent
-            current_value = self.holdings.get(symbol, 0.0) * self.stock_objects[symbol].current_price()
-            value_difference = target_value - current_value
-            
-            if value_difference > 0.01:
-                actions["buy"].append({"symbol": symbol, "amount_in_dollars": round(value_difference, 2)})
-            elif value_difference < -0.01:
-                actions["sell"].append({"symbol": symbol, "amount_in_dollars": round(abs(value_difference), 2)})
-        return actions
+        buy_idx, buy_amounts, sell_idx, sell_amounts = _plan_kernel(self.targets_arr, self._shares, self._prices)
+
+        return {
+            "buy": _orders_frame(self._symbols[buy_idx], buy_amounts),
+            "sell": _orders_frame(self._symbols[sell_idx], sell_amounts),
+        }
 
 
-    # Once we have the plan (buy and sell orders inside "actions"), we could execute it
+    # Once we have the plan (buy and sell orders), we could execute it
     # We will need to update the holdings of the portfolio
 
-    def execute_rebalance(self, plan: dict[str, list]):
-       
-        for order in plan.get("sell", []):
-            symbol, amount_to_sell = order["symbol"], order["amount_in_dollars"]
-            price = self.stock_objects[symbol].current_price()
-            # Quick check to see if the stock has a positive price
-            if price > 0:
-                shares_to_sell = amount_to_sell / price
-                # Update the holdings
-                self.holdings[symbol] = max(0.0, self.holdings.get(symbol, 0.0) - shares_to_sell)
-                if self.holdings[symbol] == 0:
-                    del self.holdings[symbol]
-
-        for order in plan.get("buy", []):
-            symbol, amount_to_buy = order["symbol"], order["amount_in_dollars"]
-            price = self.stock_objects[symbol].current_price()
-            # Quick check to see if the stock has a positive price
-            if price > 0:
-                shares_to_buy = amount_to_buy / price
-                # Update the holdings
-                self.holdings[symbol] = self.holdings.get(symbol, 0.0) + shares_to_buy
+    def execute_rebalance(self, plan: dict[str, pd.DataFrame]):
+        # Every side of the plan is turned into a dollar amount per symbol (0 where there is no order)
+        # so the holdings update is a single array operation over the whole market.
+        # Stocks without a positive price get an infinite divisor, so their orders buy/sell 0 shares.
+        prices = np.where(self._prices > 0, self._prices, np.inf)
+
+        # A plan can leave out a side, that is the same as having no orders on that side
+        # We cant hold a negative number of shares
+        np.maximum(0.0, self._shares - self._order_vector(plan.get("sell")) / prices, out=self._shares)
+        self._shares += self._order_vector(plan.get("buy")) / prices
+        self._total_dirty = True
+
+    def _order_vector(self, orders: pd.DataFrame | None) -> np.ndarray:
+        amounts = np.zeros_like(self._shares)
+        if orders is None:
+            return amounts
+        idx = np.array([self._idx[symbol] for symbol in orders["Symbol"]], dtype=np.intp)
+        np.add.at(amounts, idx, orders["Amount ($)"].to_numpy(dtype=np.float64))
+        return amounts
+
+
+# The numeric core of create_rebalance_plan, it only takes float64 arrays so numba can compile it (when installed)
+# cache=True keeps the compiled version on disk, so the compile cost is only paid on the first run
+# The total value is computed in the same pass from the per-stock values instead of a separate get_total_value()
+
+@njit(cache=True, fastmath=True)
+def _plan_kernel(targets, shares, prices):
+    values = shares * prices
+    total_value = values.sum()
+    # Quick note: if the portfolio is empty the total is 0, every difference is 0 and no orders come out
+    value_difference = targets * total_value - values
+    buy_idx = np.where(value_difference > 0.01)[0]
+    sell_idx = np.where(value_difference < -0.01)[0]
+    return buy_idx, np.round(value_difference[buy_idx], 2), sell_idx, np.round(-value_difference[sell_idx], 2)
+
+
+def _orders_frame(symbols, amounts) -> pd.DataFrame:
+    return pd.DataFrame({"Symbol": pd.Series(symbols, dtype=object), "Amount ($)": pd.Series(amounts, dtype=np.float64)})
 
 
 if __name__ == "__main__":
@@ -175,6 +277,7 @@ if __name__ == "__main__":
         Stock("GOOG", 135.00),
         Stock("MSFT", 250.00),
     ]
+    stock_map = {stock.symbol: stock for stock in all_stocks}
 
     # 2. Define our initial holdings
     initial_holdings = {
@@ -192,7 +295,7 @@ if __name__ == "__main__":
     }
 
     # 4. Create the portfolio
-    portfolio = Portfolio(all_stocks, my_target_allocation, initial_holdings)
+    portfolio = Portfolio(stock_map, my_target_allocation, initial_holdings)
 
     # 5. Check the current state of the portfolio
     portfolio.get_current_allocation()
@@ -207,16 +310,16 @@ if __name__ == "__main__":
 
     print("\n--- Rebalance Plan ---")
 
-    if rebalance_plan["buy"]:
+    if not rebalance_plan["buy"].empty:
         print("Orders to BUY:")
-        for order in rebalance_plan["buy"]:
-            print(f"  Buy ${order['amount_in_dollars']:,.2f} of {order['symbol']}")
-    if rebalance_plan["sell"]:
+        for symbol, amount in rebalance_plan["buy"].itertuples(index=False):
+            print(f"  Buy ${amount:,.2f} of {symbol}")
+    if not rebalance_plan["sell"].empty:
         print("Orders to SELL:")
-        for order in rebalance_plan["sell"]:
-            print(f"  Sell ${order['amount_in_dollars']:,.2f} of {order['symbol']}")
+        for symbol, amount in rebalance_plan["sell"].itertuples(index=False):
+            print(f"  Sell ${amount:,.2f} of {symbol}")
     
-    if not rebalance_plan["buy"] and not rebalance_plan["sell"]:
+    if rebalance_plan["buy"].empty and rebalance_plan["sell"].empty:
         print("Portfolio is already balanced. No trades needed.")
     
     # 8. Execute the rebalance plan